@@ -4,12 +4,20 @@ import numpy as np
 import plotly.express as px
 from datetime import datetime, timedelta
 import time
-from io import StringIO
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
 import os
+import json
+from urllib.parse import quote
+from uuid import uuid4
 import random
 import string
+import ahocorasick
 from dotenv import load_dotenv
-from azure.storage.blob import BlobServiceClient, ContentSettings, generate_blob_sas, BlobSasPermissions
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, ContentSettings, generate_container_sas, ContainerSasPermissions, generate_blob_sas, BlobSasPermissions
 
 # ==========================================
 # ⚙️ 1. CONFIGURATION & THEME
@@ -46,7 +54,18 @@ CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 DATA_CONTAINER = "complaint-data"
 IMAGE_CONTAINER = "complaint-images"
-BLOB_NAME = "complaints_master.csv"
+BLOB_NAME = "complaints_master.parquet"
+LEGACY_CSV_BLOB_NAME = "complaints_master.csv"
+SUBMISSION_LOG_NAME = "complaints_append.jsonl"
+# Photos are a few MB, far below the SDK's 64 MiB single-PUT threshold; 1 MiB blocks let them upload in parallel
+IMAGE_BLOCK_SIZE = 1024 * 1024
+
+# Account details parsed once at import (used for SAS signing and image URLs)
+_CS = dict(p.split('=', 1) for p in (CONNECTION_STRING or "").split(';') if '=' in p)
+_ACCOUNT_NAME = _CS.get('AccountName')
+_ACCOUNT_KEY = _CS.get('AccountKey')
+_ENDPOINT = (_CS.get('BlobEndpoint') or
+             f"{_CS.get('DefaultEndpointsProtocol', 'https')}://{_ACCOUNT_NAME}.blob.{_CS.get('EndpointSuffix', 'core.windows.net')}").rstrip('/') + "/"
 
 # Check if they loaded correctly (Optional debugging, remove later)
 if not ADMIN_PASSWORD or not CONNECTION_STRING:
@@ -57,94 +76,278 @@ class AzureBackend:
         try:
             self.service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
             self.data_client = self.service_client.get_blob_client(container=DATA_CONTAINER, blob=BLOB_NAME)
+            # Append blob of JSON lines: citizen submissions land here, admin load folds them into the master
+            self.append_client = self.service_client.get_blob_client(container=DATA_CONTAINER, blob=SUBMISSION_LOG_NAME)
+            self.image_container = ContainerClient.from_connection_string(
+                CONNECTION_STRING, IMAGE_CONTAINER,
+                max_single_put_size=IMAGE_BLOCK_SIZE, max_block_size=IMAGE_BLOCK_SIZE
+            )
         except Exception as e:
             st.error(f"Azure Connection Failed: {e}")
 
     def upload_image(self, image_file, tracking_id):
         """Uploads image and returns filename."""
         try:
-            filename = f"{tracking_id}_{image_file.name}"
-            blob_client = self.service_client.get_blob_client(container=IMAGE_CONTAINER, blob=filename)
-            blob_client.upload_blob(image_file, overwrite=True, content_settings=ContentSettings(content_type=image_file.type))
+            # Short random key instead of the user-supplied name; keep only the extension
+            ext = os.path.splitext(image_file.name)[1].lower()
+            filename = f"{tracking_id}_{uuid4().hex[:12]}{ext}"
+            blob_client = self.image_container.get_blob_client(filename)
+            blob_client.upload_blob(
+                image_file, overwrite=True,
+                content_settings=ContentSettings(content_type=image_file.type),
+                length=image_file.size, max_concurrency=4
+            )
             return filename 
         except Exception as e:
             st.error(f"Image Upload Failed: {e}")
             return None
 
-    def get_image_url(self, blob_name):
+    @staticmethod
+    def get_container_sas():
+        """One read-only SAS for the whole image container, signed once per admin session (valid 1 hour)."""
+        cached = st.session_state.get('image_sas')
+        if cached and cached['expiry'] - datetime.utcnow() > timedelta(minutes=5):
+            return cached['token']
+        expiry = datetime.utcnow() + timedelta(hours=1)
+        token = generate_container_sas(
+            account_name=_ACCOUNT_NAME,
+            container_name=IMAGE_CONTAINER,
+            account_key=_ACCOUNT_KEY,
+            permission=ContainerSasPermissions(read=True),
+            expiry=expiry
+        )
+        st.session_state['image_sas'] = {'token': token, 'expiry': expiry}
+        return token
+
+    @staticmethod
+    def get_image_url(blob_name):
         """Generates a SECURE URL (SAS Token) so images are visible."""
         if not isinstance(blob_name, str) or blob_name == "None" or not blob_name.strip():
             return None
         try:
-            blob_client = self.service_client.get_blob_client(container=IMAGE_CONTAINER, blob=blob_name)
-            
-            # Extract Account Key for SAS generation
-            account_key = None
-            for part in CONNECTION_STRING.split(';'):
-                if part.startswith('AccountKey='):
-                    account_key = part.replace('AccountKey=', '')
-                    break
-            
-            if not account_key: return blob_client.url
-
-            # Generate Token (Valid 1 hour)
+            blob_url = f"{_ENDPOINT}{IMAGE_CONTAINER}/{quote(blob_name)}"
+            if not _ACCOUNT_KEY: return blob_url
+            if st.session_state.get('is_admin'):
+                return f"{blob_url}?{AzureBackend.get_container_sas()}"
+            # Citizens only ever get a token scoped to their own blob
             sas_token = generate_blob_sas(
-                account_name=blob_client.account_name,
+                account_name=_ACCOUNT_NAME,
                 container_name=IMAGE_CONTAINER,
                 blob_name=blob_name,
-                account_key=account_key,
+                account_key=_ACCOUNT_KEY,
                 permission=BlobSasPermissions(read=True),
                 expiry=datetime.utcnow() + timedelta(hours=1)
             )
-            return f"{blob_client.url}?{sas_token}"
+            return f"{blob_url}?{sas_token}"
         except Exception:
             return None
 
     def get_schema(self):
-        return [
-            "tracking_id", "timestamp", "state", "city", "area", 
-            "category", "severity_reported", "description", 
-            "image_ref", "status", "admin_remarks",
-            "ai_category", "ai_severity", "ai_priority_score", "ai_confidence", "ai_reasoning",
-            "cluster_flag" 
-        ]
-
-    def load_data(self):
+        return list(COMPLAINT_SCHEMA)
+
+    @staticmethod
+    def _etag_or_blank(blob_client):
         try:
-            if not self.data_client.exists(): return pd.DataFrame(columns=self.get_schema())
-            stream = self.data_client.download_blob()
-            csv_text = stream.readall().decode('utf-8')
-            if not csv_text.strip(): return pd.DataFrame(columns=self.get_schema())
-            df = pd.read_csv(StringIO(csv_text))
-            
-            # Sanitization
-            for col in self.get_schema():
-                if col not in df.columns:
-                    if col == 'ai_priority_score': df[col] = 0
-                    elif col == 'cluster_flag': df[col] = False
-                    elif col == 'image_ref': df[col] = "None"
-                    else: df[col] = "Unknown"
-            
-            # Ensure types
-            if 'image_ref' in df.columns: df['image_ref'] = df['image_ref'].fillna("None").astype(str)
-            df['ai_priority_score'] = pd.to_numeric(df['ai_priority_score'], errors='coerce').fillna(0).astype(int)
-            return df
+            return blob_client.get_blob_properties().etag
+        except ResourceNotFoundError:
+            return ""
+
+    def get_data_version(self):
+        """(master ETag, submission-log ETag) from two cheap metadata calls; '' for a missing blob."""
+        master_etag = self._etag_or_blank(self.data_client)
+        if not master_etag and not st.session_state.get('legacy_csv_checked'):
+            master_etag = self._migrate_legacy_csv()
+            st.session_state.legacy_csv_checked = True
+        return (master_etag, self._etag_or_blank(self.append_client))
+
+    def _migrate_legacy_csv(self):
+        """One-off conversion of a pre-Parquet complaints_master.csv into the Parquet master.
+        The CSV blob is left in place; returns the new master ETag ('' if there is no CSV)."""
+        legacy_client = self.service_client.get_blob_client(container=DATA_CONTAINER, blob=LEGACY_CSV_BLOB_NAME)
+        try:
+            csv_text = legacy_client.download_blob().readall().decode('utf-8')
+        except ResourceNotFoundError:
+            return ""
+        if not csv_text.strip(): return ""
+        df = pd.read_csv(StringIO(csv_text))
+        
+        # Sanitization (same defaults the CSV loader used)
+        for col in COMPLAINT_SCHEMA:
+            if col not in df.columns:
+                if col == 'ai_priority_score': df[col] = 0
+                elif col == 'cluster_flag': df[col] = False
+                elif col == 'image_ref': df[col] = "None"
+                else: df[col] = "Unknown"
+        df['image_ref'] = df['image_ref'].fillna("None").astype(str)
+        df['ai_priority_score'] = pd.to_numeric(df['ai_priority_score'], errors='coerce').fillna(0).astype(int)
+        df = _apply_schema_dtypes(df[COMPLAINT_SCHEMA])
+        
+        buf = BytesIO()
+        df.to_parquet(buf, engine="pyarrow", compression="snappy", index=False)
+        try:
+            # overwrite=False: a concurrent session may have migrated (or saved) first
+            return self.data_client.upload_blob(buf.getvalue(), overwrite=False)['etag']
+        except ResourceExistsError:
+            return self._etag_or_blank(self.data_client)
+
+    def load_data(self, version=None):
+        try:
+            if version is None: version = self.get_data_version()
+            return _load_data_cached(version, CONNECTION_STRING)
         except Exception:
-            return pd.DataFrame(columns=self.get_schema())
+            # None, not an empty frame, so callers never cache a failed read under a real version
+            return None
+
+    def _upload_blocking(self, payload, log_etag):
+        """Runs on the upload worker: no Streamlit calls here, errors surface through the Future."""
+        result = self.data_client.upload_blob(payload, overwrite=True)
+        return (result['etag'], log_etag)
+
+    def save_data_async(self, df, log_etag=""):
+        """Serializes on the caller's thread, uploads in the background; returns a Future of the new version.
+        log_etag is the submission-log version already contained in df."""
+        buf = BytesIO()
+        df.to_parquet(buf, engine="pyarrow", compression="snappy", index=False)
+        _load_data_cached.clear()
+        return _upload_pool().submit(self._upload_blocking, buf.getvalue(), log_etag)
+
+    def save_data(self, df, log_etag=""):
+        """Durable save: waits for the upload and returns the new data version (None on failure)."""
+        try:
+            return self.save_data_async(df, log_etag).result()
+        except Exception as e:
+            st.error(f"Save Failed: {e}")
+            return None
 
-    def save_data(self, df):
+    def append_submission(self, record):
+        """O(1) submit: appends one JSON line to the log blob instead of rewriting the master file."""
+        block = (json.dumps(record) + "\n").encode('utf-8')
         try:
-            output = StringIO()
-            df.to_csv(output, index=False)
-            self.data_client.upload_blob(output.getvalue(), overwrite=True)
+            try:
+                self.append_client.append_block(block)
+            except ResourceNotFoundError:
+                try:
+                    self.append_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+                except ResourceExistsError:
+                    pass  # another session created it first
+                self.append_client.append_block(block)
             return True
         except Exception as e:
             st.error(f"Save Failed: {e}")
             return False
 
+    def truncate_submissions(self, log_etag):
+        """Deletes the log once folded into the master, unless it was appended to since (ETag match)."""
+        try:
+            self.append_client.delete_blob(etag=log_etag, match_condition=MatchConditions.IfNotModified)
+            return True
+        except HttpResponseError:
+            # Newer submissions arrived: keep the log, the loader skips rows the master already holds
+            return False
+
+@st.cache_resource
+def _upload_pool():
+    """One worker per process so full-blob uploads always land in the order they were made."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="blob-upload")
+
+COMPLAINT_SCHEMA = [
+    "tracking_id", "timestamp", "state", "city", "area", 
+    "category", "severity_reported", "description", 
+    "image_ref", "status", "admin_remarks",
+    "ai_category", "ai_severity", "ai_priority_score", "ai_confidence", "ai_reasoning",
+    "cluster_flag" 
+]
+
+STATUS_OPTIONS = ("Open", "In Progress", "Resolved", "Rejected")
+CATEGORY_OPTIONS = ("Road", "Water", "Electricity", "Sanitation", "Traffic", "Safety", "Internet", "Other")
+SEVERITY_OPTIONS = ("Low", "Medium", "High", "Critical")
+
+def _apply_schema_dtypes(df):
+    """Compact dtypes for the low-cardinality columns; Parquet keeps them across saves.
+    Closed vocabularies get fixed categories so in-place updates (e.g. 'Critical') never miss."""
+    for col in ['state', 'city']:
+        df[col] = df[col].astype('category')
+    for col in ['category', 'ai_category']:
+        df[col] = df[col].astype(pd.CategoricalDtype(CATEGORY_OPTIONS))
+    for col in ['severity_reported', 'ai_severity']:
+        df[col] = df[col].astype(pd.CategoricalDtype(SEVERITY_OPTIONS))
+    df['status'] = df['status'].astype(pd.CategoricalDtype(STATUS_OPTIONS))
+    # Free-text columns may load as all-NaN float64 (e.g. no remarks yet); object accepts strings
+    for col in ['admin_remarks', 'ai_reasoning']:
+        df[col] = df[col].astype(object)
+    # Views compare image_ref against the "None" sentinel; a null (e.g. a failed upload) must match it
+    df['image_ref'] = df['image_ref'].fillna("None").astype(str)
+    df['ai_priority_score'] = df['ai_priority_score'].astype('int8')
+    df['cluster_flag'] = df['cluster_flag'].astype(bool)
+    return df
+
+def _index_by_tracking_id(df):
+    """Hash-based lookups via df.loc[[tid]]; the column is kept for display and the index is never saved.
+    IDs are not guaranteed unique (the sample data repeats some), so callers must not assume one row per label."""
+    return df.set_index('tracking_id', drop=False).rename_axis(None)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_data_cached(version, connection_string):
+    """Downloads & parses master Parquet + submission log once per data version (reruns hit the cache)."""
+    master_etag, log_etag = version
+    df = pd.DataFrame(columns=COMPLAINT_SCHEMA)
+    if master_etag:
+        data_client = BlobClient.from_connection_string(connection_string, container_name=DATA_CONTAINER, blob_name=BLOB_NAME)
+        raw = data_client.download_blob().readall()
+        if raw: df = pd.read_parquet(BytesIO(raw), engine="pyarrow")
+    if log_etag:
+        log_client = BlobClient.from_connection_string(connection_string, container_name=DATA_CONTAINER, blob_name=SUBMISSION_LOG_NAME)
+        lines = log_client.download_blob().readall().splitlines()
+        log_df = pd.DataFrame([json.loads(l) for l in lines if l.strip()], columns=COMPLAINT_SCHEMA)
+        # Rows already folded into the master (log not truncated yet) keep their master version
+        log_df = log_df[~log_df['tracking_id'].isin(df['tracking_id'])]
+        if not log_df.empty: df = pd.concat([df, log_df], ignore_index=True)
+    return _index_by_tracking_id(_apply_schema_dtypes(df))
+
 # ==========================================
 # 🧠 3. AI ENGINE
 # ==========================================
+CATEGORY_KEYWORDS = {
+    "Water": ["leak", "pipe", "dirty", "supply", "water"],
+    "Road": ["pothole", "road", "street", "bump"],
+    "Electricity": ["wire", "pole", "current", "light", "spark"],
+    "Sanitation": ["garbage", "trash", "smell", "waste"]
+}
+CRITICAL_WORDS = ["danger", "death", "fire", "sparking", "flood"]
+
+@st.cache_resource
+def _keyword_automaton():
+    """Aho-Corasick automaton over every category & danger keyword, built once per process.
+    Payload is (rank, category, is_critical); rank keeps the dict-order precedence of categories."""
+    automaton = ahocorasick.Automaton()
+    for rank, (cat, keys) in enumerate(CATEGORY_KEYWORDS.items()):
+        for k in keys:
+            automaton.add_word(k, (rank, cat, False))
+    for w in CRITICAL_WORDS:
+        automaton.add_word(w, (len(CATEGORY_KEYWORDS), None, True))
+    automaton.make_automaton()
+    return automaton
+
+def _classify(desc_lower, category, severity):
+    """Pure text classifier: (ai_category, ai_severity, priority_score, reasoning)."""
+    # Single linear scan tags every category and danger keyword
+    hits = [payload for _, payload in _keyword_automaton().iter(desc_lower)]
+    cat_hits = [h for h in hits if not h[2]]
+    detected_cat = min(cat_hits)[1] if cat_hits else category
+    is_critical = any(h[2] for h in hits)
+    ai_severity = "Critical" if is_critical else severity
+    
+    sev_map = {"Low": 2, "Medium": 5, "High": 8, "Critical": 10}
+    base_score = sev_map.get(ai_severity, 5)
+    if is_critical: base_score = 10
+    
+    return detected_cat, ai_severity, base_score, f"Classified '{detected_cat}'. Severity '{ai_severity}'."
+
+@st.cache_resource
+def _cached_classifier():
+    """Memoized _classify shared per process; a bare module-level lru_cache would reset on every rerun."""
+    return lru_cache(maxsize=4096)(_classify)
+
 class AIEngine:
     @staticmethod
     def generate_tracking_id():
@@ -152,113 +355,152 @@ class AIEngine:
 
     @staticmethod
     def analyze_complaint(description, category, severity):
-        desc_lower = description.lower()
-        keywords = {
-            "Water": ["leak", "pipe", "dirty", "supply", "water"],
-            "Road": ["pothole", "road", "street", "bump"],
-            "Electricity": ["wire", "pole", "current", "light", "spark"],
-            "Sanitation": ["garbage", "trash", "smell", "waste"]
-        }
-        detected_cat = category 
-        for cat, keys in keywords.items():
-            if any(k in desc_lower for k in keys):
-                detected_cat = cat
-                break
-        
-        critical_words = ["danger", "death", "fire", "sparking", "flood"]
-        is_critical = any(w in desc_lower for w in critical_words)
-        ai_severity = "Critical" if is_critical else severity
-        
-        sev_map = {"Low": 2, "Medium": 5, "High": 8, "Critical": 10}
-        base_score = sev_map.get(ai_severity, 5)
-        if is_critical: base_score = 10
-        
+        detected_cat, ai_severity, base_score, reasoning = _cached_classifier()(description.lower().strip(), category, severity)
         return {
             "ai_category": detected_cat,
             "ai_severity": ai_severity,
             "priority_score": base_score,
-            "reasoning": f"Classified '{detected_cat}'. Severity '{ai_severity}'."
+            "reasoning": reasoning
         }
 
     @staticmethod
     def detect_bursts_and_update_priority(df):
         if df.empty: return df, False
-        df['cluster_flag'] = False
+        prev_flags = df['cluster_flag'].to_numpy(dtype=bool, copy=True)
         active_mask = df['status'].isin(['Open', 'In Progress'])
-        active_df = df[active_mask]
-        burst_counts = active_df.groupby(['city', 'category']).size()
+        # Active complaints in each row's (city, category) group, computed positionally over the
+        # full frame (no reindex: tracking IDs in the index may repeat)
+        group_size = (active_mask.groupby([df['city'], df['category']], observed=True)
+                      .transform('sum').fillna(0).astype(int))
         BURST_THRESHOLD = 3 
-        updates_made = False
+        burst_mask = (active_mask & (group_size >= BURST_THRESHOLD)).to_numpy()
+        # Tag each burst row once instead of re-appending on every admin load
+        reasoning = df['ai_reasoning'].fillna('').astype(str)
+        need_tag = burst_mask & ~reasoning.str.contains("AI BURST", regex=False).to_numpy()
+        updates_made = bool(need_tag.any() or (prev_flags != burst_mask).any())
         
-        for (city, cat), count in burst_counts.items():
-            if count >= BURST_THRESHOLD:
-                mask = (df['city'] == city) & (df['category'] == cat) & (df['status'].isin(['Open', 'In Progress']))
-                if not df.loc[mask, 'cluster_flag'].all():
-                    df.loc[mask, 'ai_severity'] = 'Critical'
-                    df.loc[mask, 'ai_priority_score'] = 10
-                    df.loc[mask, 'cluster_flag'] = True
-                    def update_reasoning(text):
-                        if "BURST DETECTED" not in str(text):
-                            return str(text) + f" [⚠ AI BURST: {count} reports in {city}]"
-                        return text
-                    df.loc[mask, 'ai_reasoning'] = df.loc[mask, 'ai_reasoning'].apply(update_reasoning)
-                    updates_made = True
+        df['cluster_flag'] = burst_mask
+        df.loc[burst_mask, 'ai_severity'] = 'Critical'
+        df.loc[burst_mask, 'ai_priority_score'] = 10
+        df.loc[need_tag, 'ai_reasoning'] = (
+            reasoning[need_tag]
+            + " [⚠ AI BURST: " + group_size[need_tag].astype(str)
+            + " reports in " + df.loc[need_tag, 'city'].astype(str) + "]"
+        ).to_numpy()
                 
         return df, updates_made
 
+def get_df(backend):
+    """Session working copy of the complaints frame; reloaded only when the blob's ETag moves."""
+    pending = st.session_state.get('pending_save')
+    if pending is not None:
+        # The blob is behind the session copy until the background upload finishes
+        if not pending.done(): return st.session_state.df
+        st.session_state.pending_save = None
+        try:
+            st.session_state.df_version = pending.result()
+        except Exception as e:
+            st.error(f"Save Failed: {e}")
+            st.session_state.pop('df', None)
+    try:
+        version = backend.get_data_version()
+    except Exception:
+        version = None
+    if 'df' not in st.session_state or st.session_state.get('df_version') != version:
+        df = backend.load_data(version)
+        if df is not None:
+            st.session_state.df = df
+            st.session_state.df_version = version
+        elif 'df' not in st.session_state:
+            # Nothing loaded yet: serve an empty frame but record no version, so the next rerun retries.
+            # A previous copy keeps its own (older) version and is retried the same way.
+            st.session_state.df = _index_by_tracking_id(pd.DataFrame(columns=backend.get_schema()))
+            st.session_state.pop('df_version', None)
+    return st.session_state.df
+
+def commit_df(backend, df, durable=False):
+    """Single save per change; keeps the session copy and its version in step with the blobs.
+    By default the upload runs in the background; durable=True waits for it."""
+    st.session_state.df = df
+    # The frame already holds every logged submission up to this log version
+    log_etag = (st.session_state.get('df_version') or ("", ""))[1]
+    if not durable:
+        try:
+            st.session_state.pending_save = backend.save_data_async(df, log_etag)
+            # Unique version for the unsaved copy; replaced by the real one once the upload lands
+            st.session_state.df_version = (f"local-{uuid4().hex}", log_etag)
+            return True
+        except Exception as e:
+            st.error(f"Save Failed: {e}")
+            return False
+    version = backend.save_data(df, log_etag)
+    if version:
+        # The single worker is FIFO, so any earlier background upload has landed too
+        st.session_state.pending_save = None
+        st.session_state.df_version = version
+    return version
+
+def compact_submissions(backend, df):
+    """Folds the submission log into the master file with one durable save, then truncates the log."""
+    version = commit_df(backend, df, durable=True)
+    if version and backend.truncate_submissions(version[1]):
+        st.session_state.df_version = (version[0], "")
+    return version
+
 # ==========================================
 # 🏙️ 4. CITIZEN PORTAL
 # ==========================================
+# Full Indian State/City Data
+INDIAN_STATES_CITIES = {
+    "Andhra Pradesh": ["Visakhapatnam", "Vijayawada", "Guntur", "Nellore", "Tirupati"],
+    "Arunachal Pradesh": ["Itanagar", "Tawang", "Pasighat"],
+    "Assam": ["Guwahati", "Silchar", "Dibrugarh", "Jorhat"],
+    "Bihar": ["Patna", "Gaya", "Bhagalpur", "Muzaffarpur"],
+    "Chhattisgarh": ["Raipur", "Bhilai", "Bilaspur"],
+    "Goa": ["Panaji", "Margao", "Vasco da Gama"],
+    "Gujarat": ["Ahmedabad", "Surat", "Vadodara", "Rajkot", "Gandhinagar", "Gandhidham"],
+    "Haryana": ["Gurugram", "Faridabad", "Panipat", "Ambala"],
+    "Himachal Pradesh": ["Shimla", "Dharamshala", "Manali"],
+    "Jharkhand": ["Ranchi", "Jamshedpur", "Dhanbad"],
+    "Karnataka": ["Bengaluru", "Mysuru", "Mangaluru", "Hubballi"],
+    "Kerala": ["Thiruvananthapuram", "Kochi", "Kozhikode", "Thrissur"],
+    "Madhya Pradesh": ["Indore", "Bhopal", "Gwalior", "Jabalpur", "Ujjain"],
+    "Maharashtra": ["Mumbai", "Pune", "Nagpur", "Nashik", "Aurangabad", "Thane"],
+    "Manipur": ["Imphal", "Thoubal"],
+    "Meghalaya": ["Shillong", "Tura"],
+    "Mizoram": ["Aizawl", "Lunglei"],
+    "Nagaland": ["Kohima", "Dimapur"],
+    "Odisha": ["Bhubaneswar", "Cuttack", "Rourkela", "Puri"],
+    "Punjab": ["Ludhiana", "Amritsar", "Jalandhar", "Chandigarh"],
+    "Rajasthan": ["Jaipur", "Jodhpur", "Udaipur", "Kota", "Ajmer"],
+    "Sikkim": ["Gangtok", "Namchi"],
+    "Tamil Nadu": ["Chennai", "Coimbatore", "Madurai", "Salem"],
+    "Telangana": ["Hyderabad", "Warangal", "Nizamabad"],
+    "Tripura": ["Agartala", "Udaipur"],
+    "Uttar Pradesh": ["Lucknow", "Kanpur", "Varanasi", "Agra", "Noida", "Deoria", "Ghaziabad"],
+    "Uttarakhand": ["Dehradun", "Haridwar", "Rishikesh", "Nainital"],
+    "West Bengal": ["Kolkata", "Howrah", "Siliguri", "Durgapur"],
+    "Delhi": ["New Delhi", "North Delhi", "South Delhi", "East Delhi", "West Delhi"],
+    "Jammu and Kashmir": ["Srinagar", "Jammu"],
+    "Ladakh": ["Leh", "Kargil"],
+    "Puducherry": ["Puducherry", "Karaikal"]
+}
+INDIAN_STATES = tuple(INDIAN_STATES_CITIES)
+
 def render_citizen_portal(backend):
     st.title("🏙️ CityWatch Citizen Services")
     
-    # Full Indian State/City Data
-    indian_states_cities = {
-        "Andhra Pradesh": ["Visakhapatnam", "Vijayawada", "Guntur", "Nellore", "Tirupati"],
-        "Arunachal Pradesh": ["Itanagar", "Tawang", "Pasighat"],
-        "Assam": ["Guwahati", "Silchar", "Dibrugarh", "Jorhat"],
-        "Bihar": ["Patna", "Gaya", "Bhagalpur", "Muzaffarpur"],
-        "Chhattisgarh": ["Raipur", "Bhilai", "Bilaspur"],
-        "Goa": ["Panaji", "Margao", "Vasco da Gama"],
-        "Gujarat": ["Ahmedabad", "Surat", "Vadodara", "Rajkot", "Gandhinagar", "Gandhidham"],
-        "Haryana": ["Gurugram", "Faridabad", "Panipat", "Ambala"],
-        "Himachal Pradesh": ["Shimla", "Dharamshala", "Manali"],
-        "Jharkhand": ["Ranchi", "Jamshedpur", "Dhanbad"],
-        "Karnataka": ["Bengaluru", "Mysuru", "Mangaluru", "Hubballi"],
-        "Kerala": ["Thiruvananthapuram", "Kochi", "Kozhikode", "Thrissur"],
-        "Madhya Pradesh": ["Indore", "Bhopal", "Gwalior", "Jabalpur", "Ujjain"],
-        "Maharashtra": ["Mumbai", "Pune", "Nagpur", "Nashik", "Aurangabad", "Thane"],
-        "Manipur": ["Imphal", "Thoubal"],
-        "Meghalaya": ["Shillong", "Tura"],
-        "Mizoram": ["Aizawl", "Lunglei"],
-        "Nagaland": ["Kohima", "Dimapur"],
-        "Odisha": ["Bhubaneswar", "Cuttack", "Rourkela", "Puri"],
-        "Punjab": ["Ludhiana", "Amritsar", "Jalandhar", "Chandigarh"],
-        "Rajasthan": ["Jaipur", "Jodhpur", "Udaipur", "Kota", "Ajmer"],
-        "Sikkim": ["Gangtok", "Namchi"],
-        "Tamil Nadu": ["Chennai", "Coimbatore", "Madurai", "Salem"],
-        "Telangana": ["Hyderabad", "Warangal", "Nizamabad"],
-        "Tripura": ["Agartala", "Udaipur"],
-        "Uttar Pradesh": ["Lucknow", "Kanpur", "Varanasi", "Agra", "Noida", "Deoria", "Ghaziabad"],
-        "Uttarakhand": ["Dehradun", "Haridwar", "Rishikesh", "Nainital"],
-        "West Bengal": ["Kolkata", "Howrah", "Siliguri", "Durgapur"],
-        "Delhi": ["New Delhi", "North Delhi", "South Delhi", "East Delhi", "West Delhi"],
-        "Jammu and Kashmir": ["Srinagar", "Jammu"],
-        "Ladakh": ["Leh", "Kargil"],
-        "Puducherry": ["Puducherry", "Karaikal"]
-    }
-
     tab1, tab2 = st.tabs(["📢 File a Complaint", "🔍 Track Status"])
     
     with tab1:
         st.markdown("### Report a Civic Issue")
         c1, c2 = st.columns(2)
         with c1:
-            sel_state = st.selectbox("State", list(indian_states_cities.keys()))
-            sel_city = st.selectbox("City", indian_states_cities[sel_state])
+            sel_state = st.selectbox("State", INDIAN_STATES)
+            sel_city = st.selectbox("City", INDIAN_STATES_CITIES[sel_state])
         with c2:
-            sel_cat = st.selectbox("Category", ["Road", "Water", "Electricity", "Sanitation", "Traffic", "Safety", "Internet", "Other"])
-            sel_sev = st.selectbox("Severity", ["Low", "Medium", "High", "Critical"])
+            sel_cat = st.selectbox("Category", CATEGORY_OPTIONS)
+            sel_sev = st.selectbox("Severity", SEVERITY_OPTIONS)
 
         with st.form("complaint_form", clear_on_submit=True):
             sel_area = st.text_input("Area / Locality", placeholder="e.g. Sector 5, Main Market")
@@ -275,7 +517,7 @@ def render_citizen_portal(backend):
                         track_id = AIEngine.generate_tracking_id()
                         img_ref = "None"
                         if uploaded_file:
-                            img_ref = backend.upload_image(uploaded_file, track_id)
+                            img_ref = backend.upload_image(uploaded_file, track_id) or "None"
                         
                         ai_result = AIEngine.analyze_complaint(desc, sel_cat, sel_sev)
                         
@@ -290,9 +532,7 @@ def render_citizen_portal(backend):
                             "ai_reasoning": ai_result['reasoning'], "cluster_flag": False
                         }
                         
-                        df = backend.load_data()
-                        df = pd.concat([df, pd.DataFrame([new_record])], ignore_index=True)
-                        backend.save_data(df)
+                        backend.append_submission(new_record)
                         
                         st.success("Complaint Registered Successfully!")
                         st.markdown(f"""
@@ -306,40 +546,76 @@ def render_citizen_portal(backend):
         track_input = st.text_input("Enter 8-Digit Tracking ID", max_chars=8).upper()
         
         if st.button("Search Record"):
-            df = backend.load_data()
-            if "tracking_id" in df.columns:
-                record = df[df['tracking_id'] == track_input]
-                if not record.empty:
-                    r = record.iloc[0]
-                    status_color = "#EF4444" if r['status'] == "Open" else "#10B981"
-                    st.markdown(f"""
-                    <div class="tracking-card">
-                        <h2 style="color: {status_color}">{r['status']}</h2>
-                        <p><b>Location:</b> {r['area']}, {r['city']}</p>
-                        <p><b>Admin Remarks:</b> {r['admin_remarks'] if pd.notna(r['admin_remarks']) else 'Pending Review'}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    if r['image_ref'] != "None":
-                        img_url = backend.get_image_url(r['image_ref'])
-                        if img_url: st.image(img_url, caption="Uploaded Evidence", width=300)
-                else:
-                    st.error("Tracking ID not found.")
+            df = get_df(backend)
+            if track_input in df.index:
+                # First match, as before: repeated IDs would otherwise return a DataFrame
+                r = df.loc[[track_input]].iloc[0]
+                status_color = "#EF4444" if r['status'] == "Open" else "#10B981"
+                st.markdown(f"""
+                <div class="tracking-card">
+                    <h2 style="color: {status_color}">{r['status']}</h2>
+                    <p><b>Location:</b> {r['area']}, {r['city']}</p>
+                    <p><b>Admin Remarks:</b> {r['admin_remarks'] if pd.notna(r['admin_remarks']) else 'Pending Review'}</p>
+                </div>
+                """, unsafe_allow_html=True)
+                if r['image_ref'] != "None":
+                    img_url = backend.get_image_url(r['image_ref'])
+                    if img_url: st.image(img_url, caption="Uploaded Evidence", width=300)
+            else:
+                st.error("Tracking ID not found.")
 
 # ==========================================
 # 👮‍♂️ 5. ADMIN DASHBOARD (IMPROVED)
 # ==========================================
+# Cached helpers over the complaints frame are keyed on the data version (ETag pair) only.
+# Frames are always passed as _underscore args, which st.cache_data never hashes,
+# so a cache lookup hashes two short strings instead of the whole frame.
+@st.cache_data(max_entries=8, show_spinner=False)
+def compute_kpis(version, _df):
+    """Overview KPIs + city/category counts in one pass, cached per data version."""
+    return {
+        "total": len(_df),
+        "critical": int((_df['ai_severity'] == 'Critical').sum()),
+        "open": int((_df['status'] == 'Open').sum()),
+        "bursts": int(_df['cluster_flag'].sum()),
+        # groupby on columns, not crosstab: crosstab aligns Series on the (non-unique) tracking_id index
+        "heatmap": _df.groupby(['category', 'city'], observed=True).size().unstack(fill_value=0),
+    }
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def density_fig(version, _heatmap):
+    """Heatmap figure built once per data version, not on every admin rerun."""
+    # Counts are already aggregated, so imshow skips Plotly Express's own groupby
+    return px.imshow(_heatmap, labels=dict(x="city", y="category", color="count"), aspect="auto",
+                     title="Complaint Density Heatmap", color_continuous_scale="Viridis")
+
+# Complaint cards per page
+PAGE_SIZE = 20
+# Only the fields a complaint card reads
+CARD_COLUMNS = ['tracking_id', 'ai_priority_score', 'category', 'city', 'status', 'timestamp',
+                'description', 'ai_reasoning', 'image_ref', 'admin_remarks']
+
 def render_admin_dashboard(backend):
     st.title("🛡️ Authority Command Center")
     
     # 1. Load Data & Run AI
-    df = backend.load_data()
+    df = get_df(backend)
     if df.empty:
         st.warning("No data found.")
         return
 
     df, updated = AIEngine.detect_bursts_and_update_priority(df)
+    log_etag = (st.session_state.get('df_version') or ("", ""))[1]
+    saved = True
+    if log_etag:
+        # Pending citizen submissions: one durable save covers them and any burst update
+        saved = compact_submissions(backend, df)
+    elif updated:
+        saved = commit_df(backend, df, durable=True)
+    if updated and not saved:
+        # Unsaved burst changes: a local version, as for edits, so cached views don't show the old frame
+        st.session_state.df_version = (f"local-{uuid4().hex}", log_etag)
     if updated:
-        backend.save_data(df)
         st.toast("⚠️ AI Analysis: High complaint volume detected!", icon="🤖")
 
     # 2. Tabs
@@ -351,14 +627,18 @@ def render_admin_dashboard(backend):
 
     # --- TAB 1: ANALYTICS ---
     with tab_overview:
+        version = st.session_state.get('df_version')
+        # No version to key on: compute uncached rather than share one None entry across frames
+        kpis = compute_kpis(version, df) if version else compute_kpis.__wrapped__(version, df)
         k1, k2, k3, k4 = st.columns(4)
-        k1.metric("Total Complaints", len(df))
-        k2.metric("Critical Issues", len(df[df['ai_severity']=='Critical']), delta_color="inverse")
-        k3.metric("Open Cases", len(df[df['status']=='Open']))
-        k4.metric("AI Burst Alerts", len(df[df['cluster_flag']==True]))
+        k1.metric("Total Complaints", kpis['total'])
+        k2.metric("Critical Issues", kpis['critical'], delta_color="inverse")
+        k3.metric("Open Cases", kpis['open'])
+        k4.metric("AI Burst Alerts", kpis['bursts'])
         
         if not df.empty:
-            fig = px.density_heatmap(df, x="city", y="category", title="Complaint Density Heatmap", color_continuous_scale="Viridis")
+            fig = (density_fig(version, kpis['heatmap']) if version
+                   else density_fig.__wrapped__(version, kpis['heatmap']))
             st.plotly_chart(fig, use_container_width=True)
 
     # --- TAB 2: COMPLAINT MANAGER (CARD VIEW) ---
@@ -379,29 +659,40 @@ def render_admin_dashboard(backend):
             sort_opt = c4.selectbox("Sort By", ["Newest First", "Oldest First", "Highest Priority"])
 
         # --- APPLY FILTERS ---
-        filtered_df = df.copy()
-        if sel_city != "All": filtered_df = filtered_df[filtered_df["city"] == sel_city]
-        if sel_cat != "All": filtered_df = filtered_df[filtered_df["category"] == sel_cat]
-        if sel_stat != "All": filtered_df = filtered_df[filtered_df["status"] == sel_stat]
+        # One combined mask, materialized once (no full-width copy of the frame)
+        mask = np.ones(len(df), dtype=bool)
+        if sel_city != "All": mask &= (df["city"] == sel_city).to_numpy()
+        if sel_cat != "All": mask &= (df["category"] == sel_cat).to_numpy()
+        if sel_stat != "All": mask &= (df["status"] == sel_stat).to_numpy()
+        filtered_df = df.loc[mask]
+        n_filtered = len(filtered_df)
+
+        # --- PAGINATION ---
+        # Only one page of cards (widgets + evidence images) is built per render
+        n_pages = max(1, (n_filtered + PAGE_SIZE - 1) // PAGE_SIZE)
+        page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1)
         
-        # --- APPLY SORTING ---
+        # --- APPLY SORTING --- (only the surviving rows are sorted)
         if sort_opt == "Newest First":
             filtered_df = filtered_df.sort_values(by="timestamp", ascending=False)
         elif sort_opt == "Oldest First":
             filtered_df = filtered_df.sort_values(by="timestamp", ascending=True)
         elif sort_opt == "Highest Priority":
-            filtered_df = filtered_df.sort_values(by="ai_priority_score", ascending=False)
+            # Partial selection of just the rows up to the current page
+            filtered_df = filtered_df.nlargest(page * PAGE_SIZE, "ai_priority_score")
+
+        page_df = filtered_df.iloc[(page - 1) * PAGE_SIZE : page * PAGE_SIZE]
 
-        st.markdown(f"**Showing {len(filtered_df)} complaints**")
+        st.markdown(f"**Showing {len(page_df)} of {n_filtered} complaints (page {page}/{n_pages})**")
 
         # --- RENDER CARDS ---
         # We use enumerate to ensure unique keys for every widget
-        for i, (_, row) in enumerate(filtered_df.iterrows()):
-            tid = row['tracking_id']
-            prio = row['ai_priority_score']
-            cat = row['category']
-            city = row['city']
-            status = row['status']
+        for i, row in enumerate(page_df[CARD_COLUMNS].itertuples(index=False)):
+            tid = row.tracking_id
+            prio = row.ai_priority_score
+            cat = row.category
+            city = row.city
+            status = row.status
             
             # Card Header Color
             header = f"[{prio}/10] {cat} in {city} ({status})"
@@ -411,31 +702,36 @@ def render_admin_dashboard(backend):
                 
                 with col_left:
                     st.markdown(f"**Tracking ID:** `{tid}`")
-                    st.markdown(f"**Date:** {row['timestamp']}")
-                    st.markdown(f"**Description:** {row['description']}")
-                    st.info(f"🤖 **AI Analysis:** {row['ai_reasoning']}")
+                    st.markdown(f"**Date:** {row.timestamp}")
+                    st.markdown(f"**Description:** {row.description}")
+                    st.info(f"🤖 **AI Analysis:** {row.ai_reasoning}")
                     
-                    # IMAGE DISPLAY
-                    img_ref = row.get("image_ref", "None")
+                    # IMAGE DISPLAY (on demand: only the selected card builds a URL / loads the photo)
+                    img_ref = row.image_ref
                     if img_ref and img_ref != "None":
-                        img_url = backend.get_image_url(img_ref)
-                        if img_url:
-                            st.image(img_url, caption="Evidence Photo", width=350)
-                        else:
-                            st.warning("Image reference found, but could not load.")
+                        if st.session_state.get('show_img') == tid:
+                            img_url = backend.get_image_url(img_ref)
+                            if img_url:
+                                st.image(img_url, caption="Evidence Photo", width=350)
+                            else:
+                                st.warning("Image reference found, but could not load.")
+                        elif st.button("📷 Show evidence", key=f"ev_{tid}_{i}"):
+                            st.session_state.show_img = tid
+                            st.rerun()
                 
                 with col_right:
                     st.markdown("### Actions")
                     # Form for updating status
                     with st.form(f"update_form_{tid}_{i}"):
-                        new_stat = st.selectbox("Update Status", ["Open", "In Progress", "Resolved", "Rejected"], index=["Open", "In Progress", "Resolved", "Rejected"].index(status))
-                        new_rem = st.text_input("Admin Remarks", value=str(row['admin_remarks']) if pd.notna(row['admin_remarks']) else "")
+                        new_stat = st.selectbox("Update Status", STATUS_OPTIONS, index=STATUS_OPTIONS.index(status))
+                        new_rem = st.text_input("Admin Remarks", value=str(row.admin_remarks) if pd.notna(row.admin_remarks) else "")
                         
                         if st.form_submit_button("💾 Update Record"):
                             # Update Main DF
-                            df.loc[df['tracking_id'] == tid, 'status'] = new_stat
-                            df.loc[df['tracking_id'] == tid, 'admin_remarks'] = new_rem
-                            backend.save_data(df)
+                            # Label-based .loc updates every row sharing the ID, like the original mask
+                            df.loc[tid, 'status'] = new_stat
+                            df.loc[tid, 'admin_remarks'] = new_rem
+                            commit_df(backend, df)
                             st.success("Updated!")
                             time.sleep(1)
                             st.rerun()
@@ -472,6 +768,7 @@ def main():
         if st.session_state.is_admin:
             if st.sidebar.button("🔴 Logout"):
                 st.session_state.is_admin = False
+                st.session_state.pop('image_sas', None)
                 st.rerun()
             render_admin_dashboard(backend)
         else: